@@ -8,7 +8,7 @@ Input:  c:\dev\vers.pdf
 Output: c:\dev\vers_with_toc.pdf
 
 Strategy:
-- Scan pages for titles (based on font size).
+- Take titles from the PDF outline if present, else scan pages for titles (based on font size).
 - Generate TOC pages with reportlab.
 - Insert TOC after page 2 (cover + impresszum), adjust page numbers accordingly.
 """
@@ -16,18 +16,23 @@ Strategy:
 from __future__ import annotations
 
 import fitz  # PyMuPDF
-from toc_core import build_toc_from_scan, render_toc_pdf
+from toc_core import (
+  assign_final_pages,
+  build_toc_from_outline,
+  build_toc_from_scan,
+  compute_toc_page_count,
+  render_toc_doc,
+)
 
 INPUT_PDF = "c:\\dev\\vers.pdf"
 OUTPUT_PDF = "c:\\dev\\vers_with_toc.pdf"
-TOC_TMP_PDF = "c:\\dev\\_generated_toc.pdf"
 
 
 def main():
   doc = fitz.open(INPUT_PDF)
 
-  # 1) Build TOC items by scanning the document
-  items = build_toc_from_scan(doc)
+  # 1) Build TOC items from the outline, or by scanning the document
+  items = build_toc_from_outline(doc) or build_toc_from_scan(doc)
 
   # 2) Decide insertion point
   # We want to insert TOC after page 2 (Cover + Impresszum).
@@ -35,63 +40,32 @@ def main():
   # So we insert at index 2.
   insertion_index = 2
 
-  # 3) Render TOC to temp file to determine its length
-  # First pass: final_page_1based is just a placeholder (orig page)
-  for it in items:
-    it.final_page_1based = it.orig_page_1based
-
+  # 3) Predict TOC length
+  # render_toc_pdf lays out pages with the same paginate_toc, and row
+  # heights do not depend on page numbers, so a single render is enough.
   rect = doc[0].rect
   page_size = (rect.width, rect.height)
-  
-  render_toc_pdf(items, TOC_TMP_PDF, page_size)
-  
-  with fitz.open(TOC_TMP_PDF) as t:
-      toc_pages = t.page_count
+
+  toc_pages = compute_toc_page_count(items, page_size)
 
   # 4) Compute final page numbers
   # If we insert `toc_pages` at `insertion_index`, then:
   # Any page that was at index `i` >= `insertion_index` will move to `i + toc_pages`.
   # Orig pages are 1-based. `insertion_index` 2 means pages 1, 2 stay. Page 3 becomes 3+toc_pages.
   # So if orig_page_1based > insertion_index, add toc_pages.
-  
-  for it in items:
-    if it.orig_page_1based > insertion_index:
-      it.final_page_1based = it.orig_page_1based + toc_pages
-    else:
-      it.final_page_1based = it.orig_page_1based
-
-  # 5) Re-render TOC with correct numbers
-  # (If the page numbers growing causes TOC to grow by another page, we might need a loop, 
-  # but usually TOC is small enough or stable enough).
-  render_toc_pdf(items, TOC_TMP_PDF, page_size)
-  
-  # Check if page count changed (rare edge case)
-  with fitz.open(TOC_TMP_PDF) as t:
-      toc_pages2 = t.page_count
-      
-  if toc_pages2 != toc_pages:
-      toc_pages = toc_pages2
-      for it in items:
-        if it.orig_page_1based > insertion_index:
-          it.final_page_1based = it.orig_page_1based + toc_pages
-        else:
-          it.final_page_1based = it.orig_page_1based
-      render_toc_pdf(items, TOC_TMP_PDF, page_size)
+  assign_final_pages(items, insertion_index, toc_pages)
+
+  # 5) Render TOC with final numbers (in memory, no temp file)
+  toc_doc = render_toc_doc(items, page_size)
 
   # 6) Merge: insert TOC into original
-  toc_doc = fitz.open(TOC_TMP_PDF)
   out = fitz.open()
-  
-  # Insert pages before insertion point
-  out.insert_pdf(doc, from_page=0, to_page=insertion_index-1)
-  
-  # Insert TOC
-  out.insert_pdf(toc_doc)
-  
-  # Insert pages after insertion point
-  out.insert_pdf(doc, from_page=insertion_index, to_page=doc.page_count-1)
-
-  out.save(OUTPUT_PDF)
+
+  # Copy the original in one pass, then splice the TOC in at the insertion point
+  out.insert_pdf(doc)
+  out.insert_pdf(toc_doc, start_at=insertion_index)
+
+  out.save(OUTPUT_PDF, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
   out.close()
   toc_doc.close()
   doc.close()
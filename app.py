@@ -1,49 +1,121 @@
-from fastapi import FastAPI, UploadFile, File, Response
-import tempfile, os
+from fastapi import FastAPI, UploadFile, File
+from fastapi.responses import FileResponse
+from starlette.background import BackgroundTask
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+import asyncio, multiprocessing, tempfile, os
 
 from toc_runner import add_toc_to_pdf
 from watermark_core import add_watermark
 
-app = FastAPI()
+def new_pdf_pool() -> ProcessPoolExecutor:
+  # PDF work is CPU-bound and PyMuPDF is not thread-safe, so it runs in a
+  # bounded pool of worker processes instead of on the event loop.
+  return ProcessPoolExecutor(
+    max_workers=os.cpu_count(),
+    mp_context=multiprocessing.get_context("spawn"),
+  )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  app.state.pdf_pool = new_pdf_pool()
+  try:
+    yield
+  finally:
+    app.state.pdf_pool.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+
+def replace_broken_pdf_pool(broken: ProcessPoolExecutor):
+  # A dead worker (segfault, OOM kill) breaks the whole pool for good;
+  # swap in a fresh one so only the requests running at that moment fail.
+  # Concurrent failures may race here, so only replace the pool once.
+  if app.state.pdf_pool is broken:
+    app.state.pdf_pool = new_pdf_pool()
+  broken.shutdown(wait=False, cancel_futures=True)
+
+
+def submit_pdf_job(fn, *args):
+  # Returns the pool the job actually went to along with its future
+  pool = app.state.pdf_pool
+  try:
+    return pool, pool.submit(fn, *args)
+  except BrokenProcessPool:
+    # Broken by an earlier request; this one never ran, so retry once
+    replace_broken_pdf_pool(pool)
+    pool = app.state.pdf_pool
+    return pool, pool.submit(fn, *args)
 
-@app.post("/toc")
-async def toc(file: UploadFile = File(...)):
-  with tempfile.TemporaryDirectory() as td:
-    inp = os.path.join(td, "in.pdf")
-    out = os.path.join(td, "out.pdf")
 
-    data = await file.read()
-    with open(inp, "wb") as f:
-      f.write(data)
+async def run_pdf_job(td: tempfile.TemporaryDirectory, fn, *args):
+  """
+  Run fn(*args) in the worker pool. If the request fails or is cancelled
+  (client disconnect), td is removed, but only once the worker is done
+  with it: a running job cannot be stopped and still writes into td.
+  """
+  pool, fut = submit_pdf_job(fn, *args)
+  try:
+    return await asyncio.wrap_future(fut)
+  except BrokenProcessPool:
+    replace_broken_pdf_pool(pool)
+    td.cleanup()
+    raise
+  except BaseException:
+    fut.add_done_callback(lambda _: td.cleanup())
+    raise
 
-    add_toc_to_pdf(inp, out)
 
-    with open(out, "rb") as f:
-      out_bytes = f.read()
+async def save_upload(file: UploadFile, path: str):
+  # Copy in chunks so large PDFs are never held in memory as a whole
+  with open(path, "wb") as f:
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+      f.write(chunk)
 
-  return Response(
-    content=out_bytes,
+
+def pdf_file_response(path: str, td: tempfile.TemporaryDirectory, filename: str):
+  # The temp dir must outlive the handler: remove it once the file is sent
+  return FileResponse(
+    path,
     media_type="application/pdf",
-    headers={"Content-Disposition": 'inline; filename="vers_with_toc.pdf"'},
+    filename=filename,
+    content_disposition_type="inline",
+    background=BackgroundTask(td.cleanup),
   )
 
+
+@app.post("/toc")
+async def toc(file: UploadFile = File(...)):
+  td = tempfile.TemporaryDirectory()
+  try:
+    inp = os.path.join(td.name, "in.pdf")
+    out = os.path.join(td.name, "out.pdf")
+
+    await save_upload(file, inp)
+  except BaseException:
+    td.cleanup()
+    raise
+
+  await run_pdf_job(td, add_toc_to_pdf, inp, out)
+
+  return pdf_file_response(out, td, "vers_with_toc.pdf")
+
 @app.post("/watermark")
 async def watermark(file: UploadFile = File(...)):
-  with tempfile.TemporaryDirectory() as td:
-    inp = os.path.join(td, "in.pdf")
-    out = os.path.join(td, "out.pdf")
+  td = tempfile.TemporaryDirectory()
+  try:
+    inp = os.path.join(td.name, "in.pdf")
+    out = os.path.join(td.name, "out.pdf")
 
-    data = await file.read()
-    with open(inp, "wb") as f:
-      f.write(data)
+    await save_upload(file, inp)
+  except BaseException:
+    td.cleanup()
+    raise
 
-    add_watermark(inp, out)
+  await run_pdf_job(td, add_watermark, inp, out)
 
-    with open(out, "rb") as f:
-      out_bytes = f.read()
-
-  return Response(
-    content=out_bytes,
-    media_type="application/pdf",
-    headers={"Content-Disposition": 'inline; filename="vers_with_watermark.pdf"'},
-  )
\ No newline at end of file
+  return pdf_file_response(out, td, "vers_with_watermark.pdf")
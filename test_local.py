@@ -1,11 +1,9 @@
 ﻿# test_local.py
 import fitz
-import tempfile
-import os
 
 from toc_core import (
   build_toc_from_scan,
-  render_toc_pdf,
+  render_toc_doc,
 )
 
 INPUT_PDF = r"C:\dev\vers.pdf"
@@ -22,13 +20,9 @@ for it in items:
 rect = doc[0].rect
 page_size = (rect.width, rect.height)
 
-with tempfile.TemporaryDirectory() as td:
-  toc_pdf = os.path.join(td, "toc.pdf")
-  render_toc_pdf(items, toc_pdf, page_size)
-
-  out = fitz.open()
-  out.insert_pdf(doc)
-  out.insert_pdf(fitz.open(toc_pdf))
-  out.save(OUTPUT_PDF)
+out = fitz.open()
+out.insert_pdf(doc)
+out.insert_pdf(render_toc_doc(items, page_size))
+out.save(OUTPUT_PDF)
 
 print("OK:", OUTPUT_PDF)
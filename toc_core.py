@@ -3,13 +3,16 @@
 
 from __future__ import annotations
 
-import re
+import io
+import math
 import os
 from dataclasses import dataclass
-from typing import List, Optional
+from functools import lru_cache
+from typing import BinaryIO, List, Optional, Tuple, Union
 
 import fitz  # PyMuPDF
 from reportlab.pdfgen import canvas
+from reportlab.pdfgen.textobject import PDFTextObject
 from reportlab.lib.units import mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
@@ -19,7 +22,8 @@ from reportlab.pdfbase.ttfonts import TTFont
 # Data model
 # =========================
 
-@dataclass
+# slots: no per-instance __dict__, cheaper attribute access in the render loop
+@dataclass(slots=True)
 class TocItem:
   title: str
   orig_page_1based: int
@@ -32,9 +36,7 @@ class TocItem:
 # =========================
 
 def normalize_line(s: str) -> str:
-  s = s.strip()
-  s = re.sub(r"\s+", " ", s)
-  return s
+  return " ".join(s.split())
 
 
 def page_lines(doc: fitz.Document, page_index: int) -> List[str]:
@@ -44,44 +46,90 @@ def page_lines(doc: fitz.Document, page_index: int) -> List[str]:
 
 
 # =========================
-# TOC extraction (Scan)
+# TOC extraction (Outline)
 # =========================
 
-def build_toc_from_scan(doc: fitz.Document) -> List[TocItem]:
+def build_toc_from_outline(doc: fitz.Document) -> List[TocItem]:
+  """
+  TOC items from the PDF's own outline (bookmarks), if it has one.
+  Top-level entries become chapters, everything deeper becomes poems.
+  Returns an empty list when there is no outline.
+  """
   items: List[TocItem] = []
 
-  # Start scanning from page index 2 (skipping 0=Cover, 1=Impresszum)
-  start_page = 2
+  for lvl, title, page in doc.get_toc(simple=True):
+    # Entries without a page destination (e.g. external links) are -1
+    if page < 1:
+      continue
 
-  for p in range(start_page, doc.page_count):
-    page = doc[p]
+    title = normalize_line(title)
+    if not title:
+      continue
 
-    # Get text blocks to analyze font size and content
-    blocks = page.get_text("dict")["blocks"]
-    text_blocks = [b for b in blocks if b["type"] == 0]
+    items.append(TocItem(
+      title=title,
+      orig_page_1based=page,
+      final_page_1based=-1,
+      level=0 if lvl == 1 else 1,
+    ))
 
-    if not text_blocks:
-      continue
+  return items
 
-    first_block = text_blocks[0]
-    if not first_block["lines"]:
-      continue
 
-    first_line = first_block["lines"][0]
-    if not first_line["spans"]:
-      continue
+# =========================
+# TOC extraction (Scan)
+# =========================
 
-    # Analyze the first span of the first line
-    span = first_line["spans"][0]
-    size = span["size"]
+_SCAN_FLAGS = fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
 
-    # Reconstruct the full title text
-    raw_text = "".join(s["text"] for s in first_line["spans"])
-    title = normalize_line(raw_text)
 
-    if not title:
+def scan_first_line(page: fitz.Page) -> Optional[Tuple[float, str]]:
+  """
+  Font size of the first span and normalized text of the first line
+  on the page, or None if the page has no usable text.
+  """
+  # Get text blocks to analyze font size and content.
+  # Image blocks are never looked at, so don't have MuPDF extract them.
+  blocks = page.get_text("dict", flags=_SCAN_FLAGS)["blocks"]
+  first_block = next((b for b in blocks if b["type"] == 0), None)
+
+  if first_block is None:
+    return None
+
+  if not first_block["lines"]:
+    return None
+
+  first_line = first_block["lines"][0]
+  if not first_line["spans"]:
+    return None
+
+  # Analyze the first span of the first line
+  size = first_line["spans"][0]["size"]
+
+  # Reconstruct the full title text
+  raw_text = "".join(s["text"] for s in first_line["spans"])
+  title = normalize_line(raw_text)
+
+  if not title:
+    return None
+
+  return size, title
+
+
+def build_toc_from_scan(doc: fitz.Document) -> List[TocItem]:
+  items: List[TocItem] = []
+
+  # Start scanning from page index 2 (skipping 0=Cover, 1=Impresszum)
+  start_page = 2
+
+  # PyMuPDF is not thread-safe, so pages are scanned serially on purpose.
+  for p in range(start_page, doc.page_count):
+    scanned = scan_first_line(doc[p])
+    if scanned is None:
       continue
 
+    size, title = scanned
+
     # Classification based on font size
     # Chapter Title: ~26pt (Level 0)
     # Poem Title: ~18.75pt (Level 1)
@@ -108,7 +156,17 @@ def build_toc_from_scan(doc: fitz.Document) -> List[TocItem]:
 # Fonts
 # =========================
 
+@lru_cache(maxsize=1)
 def register_eb_garamond():
+  # TTFont() parses the whole file; each app worker process renders a TOC
+  # for every /toc request it serves, so only register on first use.
+  # lru_cache skips even the file checks after the first successful call.
+  registered = pdfmetrics.getRegisteredFontNames()
+  if "EBGaramond" in registered and "EBGaramond-Medium" in registered:
+    return "EBGaramond", "EBGaramond-Medium"
+  if "TOC-Regular" in registered and "TOC-Medium" in registered:
+    return "TOC-Regular", "TOC-Medium"
+
   base = os.path.join(os.path.dirname(__file__), "fonts")
   reg = os.path.join(base, "EBGaramond-Regular.ttf")
   med = os.path.join(base, "EBGaramond-Medium.ttf")
@@ -132,88 +190,178 @@ def register_eb_garamond():
 # Drawing helpers
 # =========================
 
+# stringWidth walks the TTF metrics per character; the TOC only ever uses a
+# couple of (font, size) pairs, and page numbers and the "." repeat a lot.
+@lru_cache(maxsize=4096)
+def _sw(text: str, font: str, size: float) -> float:
+  return pdfmetrics.stringWidth(text, font, size)
+
+
 def draw_dot_leader(
-  c: canvas.Canvas,
+  to: PDFTextObject,
   x1: float,
   x2: float,
   y: float,
-  font: str,
-  size: float
+  dot_w: float
 ):
+  """
+  Add a dot leader from x1 to x2 to a text object. dot_w is the width
+  of "." in the text object's current font.
+  """
   if x2 <= x1:
     return
 
-  dot_w = pdfmetrics.stringWidth(".", font, size)
   step = dot_w * 1.35
-  x = x1
+  n = math.ceil((x2 - x1) / step)
+
+  # A single run of dots: char spacing widens each dot's advance to
+  # `step` instead of positioning every dot separately.
+  # Tc outlives ET, so reset it before handing the text object back.
+  to.setTextOrigin(x1, y)
+  to.setCharSpace(step - dot_w)
+  to.textOut("." * n)
+  to.setCharSpace(0)
 
-  c.setFont(font, size)
-  while x < x2:
-    c.drawString(x, y, ".")
-    x += step
+
+# =========================
+# Page numbering
+# =========================
+
+def assign_final_pages(
+  toc_items: List[TocItem],
+  insertion_index: int,
+  toc_pages: int
+):
+  """
+  Set final_page_1based for a TOC of toc_pages pages inserted before
+  page index insertion_index: pages after that point shift by toc_pages.
+  """
+  for it in toc_items:
+    orig = it.orig_page_1based
+    it.final_page_1based = orig + toc_pages if orig > insertion_index else orig
 
 
 # =========================
 # TOC rendering
 # =========================
 
+def paginate_toc(
+  toc_items: List[TocItem],
+  page_size
+) -> List[List[Tuple[TocItem, float]]]:
+  """
+  Split toc_items into TOC pages, each a list of (item, baseline y).
+  Row heights do not depend on the page numbers, so this can be called
+  before final_page_1based is known.
+  """
+  _, h = page_size
+  top = h - 25 * mm
+  bottom = 30 * mm
+  first_row_y = top - 12 * mm   # below the page header
+
+  pages: List[List[Tuple[TocItem, float]]] = [[]]
+  y = first_row_y
+
+  for item in toc_items:
+    if item.level == 0:
+      y -= 2.5 * mm
+      row_h = 7.2 * mm
+    else:
+      row_h = 6.2 * mm
+
+    if y < bottom:
+      pages.append([])
+      y = first_row_y
+
+    pages[-1].append((item, y))
+    y -= row_h
+
+  return pages
+
+
+def compute_toc_page_count(toc_items: List[TocItem], page_size) -> int:
+  """
+  Number of pages render_toc_pdf will produce for toc_items.
+  """
+  return len(paginate_toc(toc_items, page_size))
+
+
 def render_toc_pdf(
   toc_items: List[TocItem],
-  out_path: str,
+  out_path_or_buf: Union[str, BinaryIO],
   page_size,
   title: str = "Tartalom"
 ):
   font_reg, font_med = register_eb_garamond()
 
   w, h = page_size
-  c = canvas.Canvas(out_path, pagesize=page_size)
+  c = canvas.Canvas(out_path_or_buf, pagesize=page_size)
 
   left = 22 * mm
   right = w - 22 * mm
   top = h - 25 * mm
-  bottom = 30 * mm
-
-  y = top
-
-  c.setFont(font_med, 18)
-  c.drawCentredString(w / 2, y, title)
-  y -= 12 * mm
 
   poem_indent = 10 * mm
   page_gap = 6 * mm
   leader_gap_after_text = 3 * mm
 
-  for item in toc_items:
-    is_chapter = item.level == 0
+  # (font, size, text x, dot width) for chapters and poems
+  styles = (
+    (font_med, 12.5, left, _sw(".", font_med, 12.5)),
+    (font_reg, 11.5, left + poem_indent, _sw(".", font_reg, 11.5)),
+  )
 
-    if is_chapter:
-      y -= 2.5 * mm
-      f, fs, indent, row_h = font_med, 12.5, 0, 7.2 * mm
-    else:
-      f, fs, indent, row_h = font_reg, 11.5, poem_indent, 6.2 * mm
+  # The header is the same on every page: measure it once
+  title_x = w / 2 - _sw(title, font_med, 18) / 2
 
-    if y < bottom:
+  for page_no, rows in enumerate(paginate_toc(toc_items, page_size)):
+    if page_no:
       c.showPage()
-      y = top
-      c.setFont(font_med, 18)
-      c.drawCentredString(w / 2, y, title)
-      y -= 12 * mm
 
-    text_x = left + indent
-    page_str = str(item.final_page_1based)
+    # All text on a TOC page goes into one text object, starting with the header
+    to = c.beginText()
+    to.setFont(font_med, 18)
+    to.setTextOrigin(title_x, top)
+    to.textOut(title)
+    cur_font = (font_med, 18)
 
-    text_w = pdfmetrics.stringWidth(item.title, f, fs)
-    page_w = pdfmetrics.stringWidth(page_str, f, fs)
+    for item, y in rows:
+      item_title = item.title
+      f, fs, text_x, dot_w = styles[0 if item.level == 0 else 1]
 
-    page_x = right - page_w
-    leader_start = text_x + text_w + leader_gap_after_text
-    leader_end = page_x - page_gap
+      if cur_font != (f, fs):
+        to.setFont(f, fs)
+        cur_font = (f, fs)
 
-    c.setFont(f, fs)
-    c.drawString(text_x, y, item.title)
-    c.drawString(page_x, y, page_str)
-    draw_dot_leader(c, leader_start, leader_end, y, f, fs)
+      page_str = str(item.final_page_1based)
 
-    y -= row_h
+      text_w = _sw(item_title, f, fs)
+      page_w = _sw(page_str, f, fs)
+
+      page_x = right - page_w
+      leader_start = text_x + text_w + leader_gap_after_text
+      leader_end = page_x - page_gap
+
+      to.setTextOrigin(text_x, y)
+      to.textOut(item_title)
+      to.setTextOrigin(page_x, y)
+      to.textOut(page_str)
+      draw_dot_leader(to, leader_start, leader_end, y, dot_w)
+
+    c.drawText(to)
 
   c.save()
+
+
+def render_toc_doc(
+  toc_items: List[TocItem],
+  page_size,
+  title: str = "Tartalom"
+) -> fitz.Document:
+  """
+  Render the TOC in memory and open it with PyMuPDF,
+  ready to be merged with insert_pdf.
+  """
+  buf = io.BytesIO()
+  render_toc_pdf(toc_items, buf, page_size, title)
+  return fitz.open(stream=buf.getvalue(), filetype="pdf")
@@ -1,23 +1,25 @@
 ﻿# toc_runner.py
-import os
-import tempfile
 import fitz
 
 from toc_core import (
+  build_toc_from_outline,
   build_toc_from_scan,
-  render_toc_pdf,
+  render_toc_doc,
 )
 
-def add_toc_to_pdf(input_pdf: str, output_pdf: str):
+def add_toc_to_pdf(input_pdf: str, output_pdf: str, fast: bool = True):
   """
   Reads input_pdf, appends a styled TOC at the end,
   writes output_pdf.
+
+  fast=True saves without garbage collection, cleaning or recompression,
+  which is quicker but leaves the output larger.
   """
 
   doc = fitz.open(input_pdf)
 
-  # extract TOC items by scanning
-  items = build_toc_from_scan(doc)
+  # take TOC items from the outline, or extract them by scanning
+  items = build_toc_from_outline(doc) or build_toc_from_scan(doc)
 
   # TOC appended → page numbers unchanged
   for it in items:
@@ -28,18 +30,16 @@ def add_toc_to_pdf(input_pdf: str, output_pdf: str):
   rect = doc[0].rect
   page_size = (rect.width, rect.height)
 
-  with tempfile.TemporaryDirectory() as td:
-    toc_pdf = os.path.join(td, "toc.pdf")
-
-    render_toc_pdf(items, toc_pdf, page_size)
-
-    toc_doc = fitz.open(toc_pdf)
-    out = fitz.open()
-    out.insert_pdf(doc)
-    out.insert_pdf(toc_doc)
-    out.save(output_pdf)
+  # render in memory, no temp file
+  toc_doc = render_toc_doc(items, page_size)
 
-    toc_doc.close()
-    out.close()
+  # append the TOC to the source document itself instead of copying
+  # every source page into a fresh one; input_pdf is left untouched
+  doc.insert_pdf(toc_doc)
+  if fast:
+    doc.save(output_pdf, garbage=0, deflate=False, clean=False)
+  else:
+    doc.save(output_pdf, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
 
+  toc_doc.close()
   doc.close()
@@ -1,7 +1,13 @@
 import fitz
 import os
 
-def add_watermark(input_pdf: str, output_pdf: str, text: str = "MINTA"):
+def add_watermark(input_pdf: str, output_pdf: str, text: str = "MINTA", fast: bool = True):
+    """
+    Stamps text centered on every page of input_pdf, writes output_pdf.
+
+    fast=True saves without garbage collection, cleaning or recompression,
+    which is quicker but leaves the output larger.
+    """
     doc = fitz.open(input_pdf)
     
     font_path = os.path.join("fonts", "EBGaramond-Regular.ttf")
@@ -9,29 +15,48 @@ def add_watermark(input_pdf: str, output_pdf: str, text: str = "MINTA"):
 
     fontsize = 60
     color = (0.5, 0.5, 0.5) # Gray
+
+    # Load the font and measure the text once; it is the same on every page
+    if has_custom_font:
+        # Read the TTF once and hand the same bytes to every page
+        with open(font_path, "rb") as f:
+            font_bytes = f.read()
+        font = fitz.Font(fontbuffer=font_bytes)
+        fontname = "garamond"
+    else:
+        font = fitz.Font("helv")
+        fontname = "helv"
+
+    text_len = font.text_length(text, fontsize=fontsize)
+    
+    # Render the watermark once per page size into an overlay page and
+    # stamp that onto each page: every page then references the same
+    # content stream and font instead of getting its own copy of the text.
+    # All overlay pages live in one document so the font is embedded once;
+    # they are all built before the first show_pdf_page, as PyMuPDF caches
+    # the graft map per source document and it must not change afterwards.
+    overlay = fitz.open()
+    overlay_index = {}
     
     for page in doc:
-        fontname = "helv"
+        rect = page.rect
+        size = (rect.width, rect.height)
+        
+        if size in overlay_index:
+            continue
+        
+        op = overlay.new_page(width=size[0], height=size[1])
+        overlay_index[size] = op.number
         
         if has_custom_font:
-            # Register font for the page
             # page.insert_font returns the resource ID (int), but we need the name we assigned
-            page.insert_font(fontfile=font_path, fontname="garamond")
-            fontname = "garamond"
-            
-        # Calculate text width to center it
-        if has_custom_font:
-            font = fitz.Font(fontfile=font_path)
-        else:
-            font = fitz.Font(fontname)
-            
-        text_len = font.text_length(text, fontsize=fontsize)
+            op.insert_font(fontbuffer=font_bytes, fontname=fontname)
         
         # Calculate centered position
-        x = (page.rect.width - text_len) / 2
-        y = page.rect.height / 2
+        x = (size[0] - text_len) / 2
+        y = size[1] / 2
         
-        page.insert_text(
+        op.insert_text(
             (x, y),
             text,
             fontsize=fontsize,
@@ -39,5 +64,14 @@ def add_watermark(input_pdf: str, output_pdf: str, text: str = "MINTA"):
             color=color,
             fill_opacity=0.3
         )
+    
+    for page in doc:
+        rect = page.rect
+        page.show_pdf_page(rect, overlay, overlay_index[(rect.width, rect.height)])
         
-    doc.save(output_pdf)
\ No newline at end of file
+    if fast:
+        doc.save(output_pdf, garbage=0, deflate=False, clean=False)
+    else:
+        doc.save(output_pdf, garbage=4, deflate=True, deflate_images=True, deflate_fonts=True, clean=True)
+    
+    overlay.close()
\ No newline at end of file